@@ -1,12 +1,82 @@
-from flask import Flask, render_template, request, jsonify
+import functools
+import re
+import struct
+
+from flask import Flask, Response, render_template, request, jsonify
 from flask_cors import CORS
 import pandas as pd
 import numpy as np
-import io
+import orjson
+
+from kernels import compute_curves, lttb_indices, scratch_buffer
 
 app = Flask(__name__)
 CORS(app)
 
+# Rows per chunk when reading uploads, bounds parser memory on large files
+CSV_CHUNK_ROWS = 200_000
+
+# Curves longer than DOWNSAMPLE_THRESHOLD samples are reduced to about
+# DOWNSAMPLE_POINTS points for charting
+DOWNSAMPLE_THRESHOLD = 4000
+DOWNSAMPLE_POINTS = 2000
+
+# Column-name patterns for auto-detection (matched against lowercased names)
+DISP_COLUMN_RE = re.compile(r"disp|extension|delta")
+LOAD_COLUMN_RE = re.compile(r"load|force")
+
+# Response type for the float32 curve payload (see binary_response)
+BINARY_MIMETYPE = "application/octet-stream"
+
+
+@functools.lru_cache(maxsize=64)
+def detect_columns(columns):
+    """
+    Returns (disp_col, load_col): the first of the normalised column names
+    matching each pattern, or None. A column that matches both patterns is
+    only used for load when no other column matches. Cached because uploads
+    from the same rig repeat the same header.
+    """
+    disp_col = next((col for col in columns if DISP_COLUMN_RE.search(col)), None)
+    load_matches = [col for col in columns if LOAD_COLUMN_RE.search(col)]
+    load_col = next((col for col in load_matches if col != disp_col), None)
+    if load_col is None and load_matches:
+        load_col = load_matches[0]
+    return disp_col, load_col
+
+
+def binary_response(summary, curves):
+    """
+    Packs the analysis result as: a little-endian uint32 header length, a
+    JSON header (the summary plus the curve names and sample count), then
+    each curve as raw little-endian float32 values in the listed order.
+    The header is space-padded so the float data starts 4-byte aligned.
+    """
+    names = list(curves)
+    header = orjson.dumps({
+        **summary,
+        "curves": names,
+        "length": len(curves[names[0]]) if names else 0,
+    })
+    header += b" " * (-(4 + len(header)) % 4)
+
+    body = [struct.pack("<I", len(header)), header]
+    body.extend(curves[name].astype("<f4", copy=False).tobytes() for name in names)
+    return Response(b"".join(body), mimetype=BINARY_MIMETYPE)
+
+
+def json_stream(summary, curves):
+    """
+    Yields the JSON result one curve at a time so the body goes out as it is
+    encoded; orjson writes each array directly without per-element Python
+    floats. The summary object closes the document.
+    """
+    yield b"{"
+    for name, values in curves.items():
+        yield b"%s:%s," % (orjson.dumps(name), orjson.dumps(values, option=orjson.OPT_SERIALIZE_NUMPY))
+    # Drop the summary's opening brace; its closing brace ends the document
+    yield orjson.dumps(summary)[1:]
+
 
 @app.route("/")
 def index():
@@ -32,64 +102,93 @@ def analyze():
         if area <= 0 or gauge_length <= 0:
             return jsonify({"error": "Area and Gauge Length must be positive numbers."}), 400
 
-        # Read CSV
-        content = file.read().decode("utf-8")
-        df = pd.read_csv(io.StringIO(content))
+        # Probe the header and first data row, then rewind so the data pass
+        # starts at byte 0
+        header = pd.read_csv(file.stream, nrows=1)
+        file.stream.seek(0)
 
-        # Normalise column names: strip whitespace & lowercase
-        df.columns = [c.strip().lower() for c in df.columns]
+        # Normalise column names: strip whitespace & lowercase. Headers that
+        # only differ by case/whitespace map to the first such column.
+        raw_columns = {}
+        for c in header.columns:
+            raw_columns.setdefault(c.strip().lower(), c)
+        columns = list(raw_columns)
 
         # --- Detect columns ---
         # We expect columns that contain 'displacement' (or 'extension') and
         # 'load' (or 'force'). Units are assumed to be consistent.
-        disp_col = None
-        load_col = None
-        for col in df.columns:
-            if "disp" in col or "extension" in col or "delta" in col:
-                disp_col = col
-            if "load" in col or "force" in col:
-                load_col = col
+        disp_col, load_col = detect_columns(tuple(columns))
 
         if disp_col is None or load_col is None:
             return jsonify({
                 "error": (
-                    f"Could not auto-detect columns. Found: {list(df.columns)}. "
+                    f"Could not auto-detect columns. Found: {columns}. "
                     "Please ensure the CSV has columns containing 'displacement' "
                     "(or 'extension') and 'load' (or 'force')."
                 )
             }), 400
 
-        displacement = pd.to_numeric(df[disp_col], errors="coerce").dropna().values
-        load = pd.to_numeric(df[load_col], errors="coerce").dropna().values
-
-        # Ensure same length after dropping NaN
-        min_len = min(len(displacement), len(load))
-        displacement = displacement[:min_len]
-        load = load[:min_len]
+        if disp_col == load_col:
+            if len(columns) == 1:
+                # e.g. a semicolon-delimited file read as one column
+                message = (
+                    f"Only one column was found ('{disp_col}'). "
+                    "Please make sure the CSV is comma-separated."
+                )
+            else:
+                message = (
+                    f"Column '{disp_col}' looks like both displacement and load. "
+                    "Please rename it so each quantity has its own column."
+                )
+            return jsonify({"error": message}), 400
 
-        # --- Calculations ---
-        # Stress (MPa) = Force (N) / Area (m²) → Pa, then /1e6 → MPa
-        stress = load / area
-        stress_mpa = stress / 1e6
+        # Instron/MTS exports put a units row (e.g. "mm,N") under the header;
+        # skip it rather than rejecting the file as non-numeric
+        usecols = [raw_columns[disp_col], raw_columns[load_col]]
+        has_units_row = len(header) > 0 and not all(
+            pd.api.types.is_numeric_dtype(header[c]) for c in usecols
+        )
 
-        # Strain (mm/mm) = (Displacement (mm) / 1000) / Original Length (m)
-        # User specified raw displacement is in mm
-        strain = (displacement / 1000) / gauge_length
+        # Read only the two detected columns straight from the upload stream,
+        # with a fixed dtype so pandas skips type inference. Reading in chunks
+        # keeps peak memory to the final arrays plus one chunk.
+        disp_chunks = []
+        load_chunks = []
+        try:
+            reader = pd.read_csv(
+                file.stream,
+                usecols=usecols,
+                skiprows=[1] if has_units_row else None,
+                dtype=np.float64,
+                engine="c",
+                chunksize=CSV_CHUNK_ROWS,
+            )
+            for chunk in reader:
+                disp_chunks.append(chunk[raw_columns[disp_col]].to_numpy())
+                load_chunks.append(chunk[raw_columns[load_col]].to_numpy())
+        except ValueError:
+            return jsonify({
+                "error": (
+                    f"Columns '{disp_col}' and '{load_col}' must contain only "
+                    "numeric values."
+                )
+            }), 400
 
-        # Young's Modulus (MPa) = Stress / Strain at each point
-        # Handle division by zero where strain is 0
-        with np.errstate(divide='ignore', invalid='ignore'):
-            youngs_modulus_arr = np.where(strain != 0, stress_mpa / strain, 0.0)
+        displacement = np.concatenate(disp_chunks) if disp_chunks else np.empty(0)
+        load = np.concatenate(load_chunks) if load_chunks else np.empty(0)
 
-        # Slope Angle (degrees) = arctan(Young's Modulus)
-        # Note: This is purely mathematical based on the values. Visually it depends on axis scaling.
-        slope_angles = np.degrees(np.arctan(youngs_modulus_arr))
+        # Drop incomplete rows (blank cells parse as NaN) in one pass over both
+        # columns so displacement and load stay aligned row by row
+        complete = ~(np.isnan(displacement) | np.isnan(load))
+        if not complete.all():
+            displacement = displacement[complete]
+            load = load[complete]
 
-        # --- Calculate Tangent Modulus (Instantaneous Slope) ---
-        try:
-            tangent_modulus_arr = np.gradient(stress_mpa, strain)
-        except ValueError:
-            tangent_modulus_arr = np.zeros_like(stress_mpa)
+        # --- Calculations ---
+        # Stress (MPa), Strain (mm/mm), Young's Modulus (MPa) = Stress / Strain,
+        # Slope Angle (degrees) and Tangent Modulus (instantaneous slope)
+        (stress_mpa, strain, youngs_modulus_arr,
+         slope_angles, tangent_modulus_arr) = compute_curves(load, displacement, area, gauge_length)
 
         # --- Yield Strength (0.2% Offset Method) ---
         # Robust E calculation: Peak Tangent Modulus in the elastic region
@@ -101,24 +200,25 @@ def analyze():
         elastic_mask = (stress_mpa > 0.05 * max_stress_val) & (strain < 0.5 * max_strain_val)
         
         if np.any(elastic_mask):
-             # Use the median of the top 10% steepest slopes in this region
+             # Use the mean of the top 10% steepest slopes in this region
+             # (partition selects them in O(M) without a full sort)
              valid_slopes = tangent_modulus_arr[elastic_mask]
-             threshold = np.percentile(valid_slopes, 90)
-             E = float(np.mean(valid_slopes[valid_slopes >= threshold]))
+             k = max(1, valid_slopes.size // 10)
+             E = float(np.partition(valid_slopes, -k)[-k:].mean())
         else:
              # Fallback
              E = float(np.max(tangent_modulus_arr[:max(5, int(len(strain)*0.2))])) if len(strain) > 5 else 1.0
 
-        # Define Offset Line: y = E * (x - 0.002)
-        offset_stress = E * (strain - 0.002)
+        # Define Offset Line: y = E * (x - 0.002), built in one scratch buffer
+        offset_stress = scratch_buffer("offset_stress", strain.size)
+        np.subtract(strain, 0.002, out=offset_stress)
+        np.multiply(offset_stress, E, out=offset_stress)
 
         # Find Intersection: where Stress Curve CROSSES Offset Line
-        yield_index = None
-        for i in range(len(strain)):
-            if strain[i] > 0.002 and stress_mpa[i] < offset_stress[i]:
-                yield_index = i - 1
-                break
-        
+        crossed = np.less(stress_mpa, offset_stress)
+        crossed &= strain > 0.002
+        yield_index = int(crossed.argmax()) - 1 if crossed.any() else None
+
         if yield_index is None:
              yield_point = None
         else:
@@ -140,28 +240,16 @@ def analyze():
         # --- Fracture Point ---
         # Search for steepest drop (minimum tangent modulus) AFTER the peak stress
         # This prevents picking up initial settling noise as a "drop"
-        peak_idx = np.argmax(stress_mpa)
-        
-        # Slice from peak to end
-        post_peak_tangent = tangent_modulus_arr[peak_idx:]
-        
-        if len(post_peak_tangent) > 1:
-            # Find min slope in post-peak region
-            min_slope_idx_local = np.argmin(post_peak_tangent)
-            min_slope_val = post_peak_tangent[min_slope_idx_local]
-            
-            # Global index
-            min_slope_idx = peak_idx + min_slope_idx_local
-            
-            # Significant drop threshold: Slope < -0.05 * E (or just negative enough)
-            # If brittle failure (at peak), min_slope_idx might be 0 (local).
-            if min_slope_val < -0.05 * E:
-                # Fracture is point before drop
-                fracture_idx = max(peak_idx, min_slope_idx - 1)
-            else:
-                fracture_idx = peak_idx # Default to max stress if no sharp drop found
+        peak_idx = int(np.argmax(stress_mpa))
+        min_slope_idx = peak_idx + int(np.argmin(tangent_modulus_arr[peak_idx:]))
+
+        # Significant drop threshold: Slope < -0.05 * E (or just negative enough)
+        # If brittle failure (at peak), min_slope_idx is peak_idx itself.
+        if tangent_modulus_arr[min_slope_idx] < -0.05 * E:
+            # Fracture is point before drop
+            fracture_idx = max(peak_idx, min_slope_idx - 1)
         else:
-            fracture_idx = peak_idx
+            fracture_idx = peak_idx # Default to max stress if no sharp drop found
 
         fracture_point = {
             "strain": float(strain[fracture_idx]),
@@ -175,13 +263,16 @@ def analyze():
         max_load = float(np.max(load))
         yield_strength = yield_point["stress"] if yield_point else 0.0
 
-        return jsonify({
-            "displacement": displacement.tolist(),
-            "load": load.tolist(),
-            "stress": stress_mpa.tolist(),
-            "strain": strain.tolist(),
-            "youngs_modulus": youngs_modulus_arr.tolist(),
-            "slope_angles": slope_angles.tolist(),
+        # Per-sample curves, all of the same length
+        curves = {
+            "displacement": displacement,
+            "load": load,
+            "stress": stress_mpa,
+            "strain": strain,
+            "youngs_modulus": youngs_modulus_arr,
+            "slope_angles": slope_angles,
+        }
+        summary = {
             "yield_point": yield_point,
             "yield_index": yield_index,
             "fracture_point": fracture_point,
@@ -196,7 +287,28 @@ def analyze():
                 "displacement": disp_col,
                 "load": load_col,
             }
-        })
+        }
+
+        # Charts only need a couple of thousand points, so thin long curves
+        # before serialising. The yield and fracture samples are always kept.
+        if strain.size > DOWNSAMPLE_THRESHOLD:
+            keep = lttb_indices(strain, stress_mpa, DOWNSAMPLE_POINTS)
+            marks = [i for i in (yield_index, fracture_idx) if i is not None and i >= 0]
+            keep = np.union1d(keep, marks)
+            curves = {name: values[keep] for name, values in curves.items()}
+            if yield_index is not None and yield_index >= 0:
+                # The frontend slices the curves by yield_index
+                summary["yield_index"] = int(np.searchsorted(keep, yield_index))
+
+        # The frontend asks for the compact binary form; JSON stays the default
+        best = request.accept_mimetypes.best_match(["application/json", BINARY_MIMETYPE])
+        if best == BINARY_MIMETYPE:
+            return binary_response(summary, curves)
+
+        # Cast now: the float32 copies detach the response from this thread's
+        # scratch buffers before the body is streamed
+        curves = {name: values.astype(np.float32) for name, values in curves.items()}
+        return Response(json_stream(summary, curves), mimetype="application/json")
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -0,0 +1,37 @@
+"""
+Ahead-of-time compiles the fused curve kernel into the tta_kernels
+extension module next to this file. With TTA_AOT_KERNELS=1, kernels.py
+uses it instead of the JIT kernel, so server workers skip Numba's compile
+on their first request. The build records kernels.kernel_version() and is
+ignored once _fill_curves changes.
+
+Usage (requires Numba and a C compiler):
+
+    python build_kernels.py
+"""
+import os
+
+from numba.pycc import CC
+
+from kernels import _fill_curves, kernel_version
+
+KERNEL_VERSION = kernel_version()
+
+cc = CC("tta_kernels")
+cc.output_dir = os.path.dirname(os.path.abspath(__file__))
+cc.export(
+    "fill_curves",
+    "void(f8[::1], f8[::1], f8, f8, f8[::1], f8[::1], f8[::1], f8[::1], f8[::1])",
+)(_fill_curves)
+
+
+def _kernel_version():
+    # KERNEL_VERSION is frozen into the extension as a constant
+    return KERNEL_VERSION
+
+
+cc.export("kernel_version", "i8()")(_kernel_version)
+
+
+if __name__ == "__main__":
+    cc.compile()
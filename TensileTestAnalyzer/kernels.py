@@ -0,0 +1,267 @@
+"""
+Numerical kernels for the tensile test calculations.
+
+compute_curves() turns raw load / displacement samples into the per-point
+stress, strain, Young's modulus, slope angle and tangent modulus arrays.
+When Numba is installed this runs as a single fused, parallel loop; with
+numexpr it runs as multithreaded element-wise passes; otherwise it falls
+back to plain NumPy.
+"""
+import inspect
+import math
+import os
+import threading
+import warnings
+import zlib
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:  # Numba is optional
+    njit = None
+
+try:
+    import numexpr as ne
+except ImportError:  # numexpr is optional
+    ne = None
+else:
+    # Leave one core for the web server itself
+    ne.set_num_threads(max(1, (os.cpu_count() or 1) - 1))
+
+
+# Per-thread work arrays, see scratch_buffer()
+_scratch = threading.local()
+
+# Largest request (in samples) served from the per-thread buffers; bigger
+# uploads get fresh arrays so one huge file can't pin memory on a thread
+SCRATCH_MAX_SAMPLES = 1 << 18
+
+# Scratch buffer names for the compute_curves() outputs, in return order
+CURVE_BUFFERS = ("stress_mpa", "strain", "youngs_modulus", "slope_angles", "tangent_modulus")
+
+
+def _divisors(area, gauge_length):
+    # Unit conversions folded into one divisor each, so every sample costs a
+    # single division instead of two
+    stress_divisor = area * 1e6
+    strain_divisor = 1000.0 * gauge_length
+    return stress_divisor, strain_divisor
+
+
+def _compute_curves_numpy(load, displacement, stress_divisor, strain_divisor,
+                          stress_mpa, strain, youngs_modulus_arr, slope_angles, tangent_modulus_arr):
+    # Stress (MPa) = Force (N) / Area (m²) → Pa, then /1e6 → MPa
+    np.divide(load, stress_divisor, out=stress_mpa)
+
+    # Strain (mm/mm) = (Displacement (mm) / 1000) / Original Length (m)
+    # User specified raw displacement is in mm
+    np.divide(displacement, strain_divisor, out=strain)
+
+    # Young's Modulus (MPa) = Stress / Strain at each point
+    # Points where strain is 0 are skipped by the masked divide and stay 0
+    youngs_modulus_arr.fill(0.0)
+    np.divide(stress_mpa, strain, out=youngs_modulus_arr, where=strain != 0)
+
+    # Slope Angle (degrees) = arctan(Young's Modulus)
+    # Note: This is purely mathematical based on the values. Visually it depends on axis scaling.
+    # Computed in place: one buffer for both the arctan and the degree scaling
+    np.arctan(youngs_modulus_arr, out=slope_angles)
+    np.multiply(slope_angles, 180.0 / np.pi, out=slope_angles)
+
+    _tangent_modulus(stress_mpa, strain, tangent_modulus_arr)
+
+
+def _compute_curves_numexpr(load, displacement, stress_divisor, strain_divisor,
+                            stress_mpa, strain, youngs_modulus_arr, slope_angles, tangent_modulus_arr):
+    # Same formulas as the NumPy path, each evaluated as one multithreaded pass
+    ne.evaluate("load / stress_divisor", out=stress_mpa)
+    ne.evaluate("displacement / strain_divisor", out=strain)
+    ne.evaluate("where(strain != 0, stress_mpa / strain, 0.0)", out=youngs_modulus_arr)
+    ne.evaluate("arctan(youngs_modulus_arr) * (180.0 / 3.141592653589793)", out=slope_angles)
+    _tangent_modulus(stress_mpa, strain, tangent_modulus_arr)
+
+
+def _tangent_modulus(stress_mpa, strain, tangent_modulus_arr):
+    # Tangent Modulus (Instantaneous Slope): central differences inside,
+    # one-sided differences at the two ends
+    n = stress_mpa.size
+    if n < 2:
+        tangent_modulus_arr.fill(0.0)
+        return
+    interior = tangent_modulus_arr[1:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.subtract(stress_mpa[2:], stress_mpa[:-2], out=interior)
+        np.divide(interior, strain[2:] - strain[:-2], out=interior)
+        tangent_modulus_arr[0] = (stress_mpa[1] - stress_mpa[0]) / (strain[1] - strain[0])
+        tangent_modulus_arr[-1] = (stress_mpa[-1] - stress_mpa[-2]) / (strain[-1] - strain[-2])
+
+
+def _fill_curves(load, displacement, stress_divisor, strain_divisor,
+                 stress_mpa, strain, youngs_modulus_arr, slope_angles, tangent_modulus_arr):
+    # Fused loop shared by the JIT (_compute_curves_numba) and AOT
+    # (build_kernels.py) builds; it only runs compiled. prange falls back to
+    # a serial loop in the AOT build.
+    n = load.size
+    for i in prange(n):
+        s = load[i] / stress_divisor
+        e = displacement[i] / strain_divisor
+        ym = s / e if e != 0 else 0.0
+        stress_mpa[i] = s
+        strain[i] = e
+        youngs_modulus_arr[i] = ym
+        slope_angles[i] = math.degrees(math.atan(ym))
+
+        # Central differences inside, one-sided at the ends. Neighbours
+        # are recomputed from the inputs so every iteration only writes
+        # its own index.
+        if n < 2:
+            ds = 0.0
+            de = 1.0
+        elif i == 0:
+            ds = load[1] / stress_divisor - s
+            de = displacement[1] / strain_divisor - e
+        elif i == n - 1:
+            ds = s - load[i - 1] / stress_divisor
+            de = e - displacement[i - 1] / strain_divisor
+        else:
+            ds = load[i + 1] / stress_divisor - load[i - 1] / stress_divisor
+            de = displacement[i + 1] / strain_divisor - displacement[i - 1] / strain_divisor
+
+        # Never divides by zero: the AOT build uses Python's error model,
+        # which would raise instead of giving NumPy's inf/nan
+        tangent_modulus_arr[i] = ds / de if de != 0 else ds * math.inf
+
+
+if njit is not None:
+    # fastmath is left off because repeated displacement readings
+    # legitimately produce inf/nan tangent values.
+    _compute_curves_numba = njit(parallel=True, cache=True)(_fill_curves)
+
+
+def kernel_version():
+    """
+    Returns a CRC32 fingerprint of _fill_curves' source. build_kernels.py bakes
+    it into the ahead-of-time build so a stale extension is never used. Raises
+    OSError when the source isn't available (e.g. a bytecode-only install).
+    """
+    return zlib.crc32(inspect.getsource(_fill_curves).encode("utf-8"))
+
+
+def _load_aot_kernel():
+    # The ahead-of-time build (see build_kernels.py) is opt-in: it is only
+    # used when TTA_AOT_KERNELS=1 and it was built from this _fill_curves
+    if os.environ.get("TTA_AOT_KERNELS") != "1":
+        return None
+    try:
+        import tta_kernels
+    except ImportError:
+        warnings.warn("TTA_AOT_KERNELS=1 but tta_kernels is not built; run build_kernels.py.")
+        return None
+    try:
+        current_version = kernel_version()
+    except OSError:
+        warnings.warn("kernels.py source is unavailable, so tta_kernels can't be checked; using the JIT kernel.")
+        return None
+    if tta_kernels.kernel_version() != current_version:
+        warnings.warn("tta_kernels is out of date with kernels.py; rebuild it with build_kernels.py.")
+        return None
+    return tta_kernels.fill_curves
+
+
+_compute_curves_aot = _load_aot_kernel()
+
+
+def scratch_buffer(name, n):
+    """
+    Returns an n-element float64 work array that is reused across requests
+    handled by the same thread. The backing buffer grows by doubling up to
+    SCRATCH_MAX_SAMPLES; larger requests get a fresh, unshared array.
+
+    Reuse only pays off on servers with long-lived worker threads (e.g.
+    gunicorn/waitress thread pools). Werkzeug's dev server started by
+    `python app.py` uses a new thread per request, so there every call
+    allocates anyway.
+    """
+    if n > SCRATCH_MAX_SAMPLES:
+        return np.empty(n)
+
+    buf = getattr(_scratch, name, None)
+    if buf is None or buf.size < n:
+        size = n if buf is None else min(max(n, 2 * buf.size), SCRATCH_MAX_SAMPLES)
+        buf = np.empty(size)
+        setattr(_scratch, name, buf)
+    return buf[:n]
+
+
+# Flask serves requests on several threads, but Numba's fallback "workqueue"
+# threading layer aborts the process if two threads enter a parallel kernel
+# at once, so parallel kernel calls take turns
+_numba_lock = threading.Lock()
+
+
+def compute_curves(load, displacement, area, gauge_length):
+    """
+    Returns (stress_mpa, strain, youngs_modulus, slope_angles, tangent_modulus)
+    for the given load (N) and displacement (mm) samples.
+
+    For uploads up to SCRATCH_MAX_SAMPLES the arrays are views into this
+    thread's scratch buffers and are overwritten by the next call on the
+    same thread.
+    """
+    load = np.ascontiguousarray(load, dtype=np.float64)
+    displacement = np.ascontiguousarray(displacement, dtype=np.float64)
+    stress_divisor, strain_divisor = _divisors(float(area), float(gauge_length))
+
+    n = load.size
+    out = tuple(scratch_buffer(name, n) for name in CURVE_BUFFERS)
+
+    if _compute_curves_aot is not None:
+        _compute_curves_aot(load, displacement, stress_divisor, strain_divisor, *out)
+    elif njit is not None:
+        with _numba_lock:
+            _compute_curves_numba(load, displacement, stress_divisor, strain_divisor, *out)
+    elif ne is not None:
+        _compute_curves_numexpr(load, displacement, stress_divisor, strain_divisor, *out)
+    else:
+        _compute_curves_numpy(load, displacement, stress_divisor, strain_divisor, *out)
+    return out
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets downsampling. Returns the sorted indices
+    of n_out points that best preserve the visual shape of the (x, y) curve;
+    the first and last samples are always kept.
+    """
+    n = x.size
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # n_out - 2 buckets spanning the interior samples [1, n - 1)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)
+
+    indices = np.empty(n_out, dtype=np.intp)
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # Third vertex: mean of the next bucket (or the last point)
+        if i < n_out - 3:
+            next_start, next_end = edges[i + 1], edges[i + 2]
+            cx = x[next_start:next_end].mean()
+            cy = y[next_start:next_end].mean()
+        else:
+            cx, cy = x[-1], y[-1]
+
+        # Keep the point forming the largest triangle with the previous pick
+        areas = np.abs((x[a] - cx) * (y[start:end] - y[a])
+                       - (x[a] - x[start:end]) * (cy - y[a]))
+        a = start + int(np.argmax(areas))
+        indices[i + 1] = a
+
+    return indices
+
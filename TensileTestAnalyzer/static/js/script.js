@@ -63,8 +63,14 @@ form.addEventListener('submit', async e => {
     const fd = new FormData(form);
 
     try {
-        const res = await fetch('/analyze', { method: 'POST', body: fd });
-        const data = await res.json();
+        const res = await fetch('/analyze', {
+            method: 'POST',
+            body: fd,
+            headers: { Accept: 'application/octet-stream' }
+        });
+        // Errors still come back as JSON; results use the binary layout
+        const isBinary = (res.headers.get('Content-Type') || '').startsWith('application/octet-stream');
+        const data = isBinary ? decodeBinary(await res.arrayBuffer()) : await res.json();
 
         if (!res.ok || data.error) {
             showError(data.error || 'Unknown server error.');
@@ -86,6 +92,21 @@ form.addEventListener('submit', async e => {
     }
 });
 
+// ---------- Binary payload ----------
+// Layout: uint32 header length (LE), JSON header, then one float32 array
+// per name in header.curves, each header.length values long.
+function decodeBinary(buffer) {
+    const headerLen = new DataView(buffer).getUint32(0, true);
+    const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, headerLen)));
+
+    let offset = 4 + headerLen;
+    for (const name of header.curves) {
+        header[name] = Array.from(new Float32Array(buffer, offset, header.length));
+        offset += header.length * Float32Array.BYTES_PER_ELEMENT;
+    }
+    return header;
+}
+
 // ---------- Error helpers ----------
 function showError(msg) {
     errorToast.textContent = msg;